@@ -8,7 +8,31 @@ Description: A module for defining the ESGStockAPI class, which reads, processes
              the backend for the interactive dashboard.
 """
 
+import os
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pathlib import Path
+
+# Mapping from the ESG dataset's dimension score columns to their display names
+ESG_DIMENSIONS = {"environmentScore": "Environmental", "socialScore": "Social",
+                  "governanceScore": "Governance"}
+
+# Version of the processed Parquet cache format, to be increased whenever the processing
+# in read_csv_data changes so that caches written by earlier versions are rebuilt
+CACHE_VERSION = 1
+
+# ESG and beta levels, from lowest to highest
+ESG_LEVELS = ["Low ESG", "Medium ESG", "High ESG"]
+BETA_LEVELS = ["Low Beta", "Medium Beta", "High Beta"]
+
+# Percentile cutoffs for the high and medium ESG levels
+HIGH_ESG_PERCENTILE = 66
+MEDIUM_ESG_PERCENTILE = 33
+
+# Standard beta cutoffs for the low and medium beta levels
+LOW_BETA_CUTOFF = 0.8
+MEDIUM_BETA_CUTOFF = 1.2
 
 class ESGStockAPI:
 
@@ -20,9 +44,59 @@ class ESGStockAPI:
         """
         self.esg = None
         self.stocks = None
+        self.stock_slices = None
+        self.company_names = None
 
 
     def read_data(self, esg_filename, stocks_filename):
+        """
+        Parameters: esg_filename (str) - the file path to the ESG dataset in CSV format
+                    stocks_filename (str) - the file path to the stocks dataset in CSV format
+        Returns: none
+        Does: reads and processes the ESG and stock datasets from the specified CSV files
+              into their respective DataFrames, caching the processed DataFrames as Parquet
+              files next to the CSV files so that later reads skip the CSV processing
+        """
+        # Load the processed DataFrames from the Parquet cache if it is up to date with the
+        # CSV files and the current cache format, and the stock prices are sorted as expected
+        esg_cache = Path(esg_filename).with_suffix(f".v{CACHE_VERSION}.parquet")
+        stocks_cache = Path(stocks_filename).with_suffix(f".v{CACHE_VERSION}.parquet")
+        cache_loaded = False
+        if self.is_cache_current(esg_filename, esg_cache) and \
+                self.is_cache_current(stocks_filename, stocks_cache):
+            # Treat an unreadable cache (e.g. a partially written file) like an outdated one
+            try:
+                self.esg = pd.read_parquet(esg_cache, engine = "pyarrow")
+                self.stocks = pd.read_parquet(stocks_cache, engine = "pyarrow")
+                cache_loaded = self.is_sorted_by_company_and_date(self.stocks)
+            except (OSError, pa.ArrowException):
+                cache_loaded = False
+
+        # Otherwise process the CSV files and cache the results, keeping the processed
+        # DataFrames if the cache cannot be written (e.g. the data directory is read-only)
+        if not cache_loaded:
+            self.read_csv_data(esg_filename, stocks_filename)
+            try:
+                self.write_cache(self.esg, esg_cache)
+                self.write_cache(self.stocks, stocks_cache)
+            except OSError:
+                pass
+
+        # Classify the ESG and beta levels of each company once
+        self.esg["ESG Level"] = self.classify_esg_levels(self.esg["percentile"])
+        self.esg["Beta Level"] = self.classify_beta_levels(self.esg["beta"])
+
+        # Create a dictionary mapping each company name to the start and end (exclusive)
+        # positions of its rows, which are contiguous since the stock DataFrame is sorted
+        # by company and date
+        stock_rows = self.stocks.groupby("Full Name", sort = False, observed = True).indices
+        self.stock_slices = {name: (rows[0], rows[-1] + 1) for name, rows in stock_rows.items()}
+
+        # Store the sorted list of company names from the ESG DataFrame
+        self.company_names = sorted(self.esg["Full Name"].tolist())
+
+
+    def read_csv_data(self, esg_filename, stocks_filename):
         """
         Parameters: esg_filename (str) - the file path to the ESG dataset in CSV format
                     stocks_filename (str) - the file path to the stocks dataset in CSV format
@@ -38,27 +112,96 @@ class ESGStockAPI:
         ticker_to_name = dict(zip(self.esg["Symbol"], self.esg["Full Name"]))
 
         # Read the stock dataset into a DataFrame and convert the "Date" column
-        # to datetime without timezone
+        # (e.g. "2023-01-03 00:00:00+00:00") to datetime without timezone
         initial_stocks_df = pd.read_csv(stocks_filename)
-        initial_stocks_df["Date"] = pd.to_datetime(initial_stocks_df["Date"]).dt.tz_localize(None)
-
-        # Reshape the DataFrame from wide to long format and keep only rows
-        # that match companies in the ESG DataFrame
-        adjusted_stocks_df = initial_stocks_df.melt(id_vars = ["Date"],
-                                                    var_name = "Symbol", value_name = "Price")
-        adjusted_stocks_df = adjusted_stocks_df[adjusted_stocks_df["Symbol"].isin(ticker_to_name)]
-        adjusted_stocks_df["Full Name"] = adjusted_stocks_df["Symbol"].map(ticker_to_name)
+        initial_stocks_df["Date"] = pd.to_datetime(initial_stocks_df["Date"],
+                                                   format = "%Y-%m-%d %H:%M:%S%z",
+                                                   exact = True).dt.tz_localize(None)
+
+        # Keep only the ticker columns that match companies in the ESG DataFrame and
+        # reshape the DataFrame from wide to long format
+        keep_cols = ["Date"] + [col for col in initial_stocks_df.columns if col in ticker_to_name]
+        adjusted_stocks_df = initial_stocks_df[keep_cols].melt(id_vars = ["Date"], var_name = "Symbol",
+                                                               value_name = "Price")
+
+        # Store the prices in single precision, which is enough for daily closing prices
+        adjusted_stocks_df["Price"] = adjusted_stocks_df["Price"].astype("float32")
+
+        # Store the repeated ticker symbols as a categorical column, with the symbols ordered
+        # by company name, and map them to company names through their category codes, since
+        # several tickers (e.g. share classes) may belong to the same company
+        symbols = sorted(ticker_to_name, key = ticker_to_name.get)
+        symbol_cat = pd.Categorical(adjusted_stocks_df["Symbol"], categories = symbols)
+        names = pd.Index(sorted(set(ticker_to_name.values())))
+        name_codes = names.get_indexer([ticker_to_name[symbol] for symbol in symbols])
+        adjusted_stocks_df["Symbol"] = symbol_cat
+        adjusted_stocks_df["Full Name"] = pd.Categorical.from_codes(name_codes[symbol_cat.codes],
+                                                                    categories = names)
+
+        # Sort the stock prices by company and date once so that later filters keep this order
+        adjusted_stocks_df = adjusted_stocks_df.sort_values(["Full Name", "Date"], ignore_index = True)
 
         self.stocks = adjusted_stocks_df
 
 
+    @staticmethod
+    def write_cache(df, cache_filename):
+        """
+        Parameters: df (pd.DataFrame) - a processed DataFrame to cache
+                    cache_filename (Path) - the file path to the DataFrame's Parquet cache
+        Returns: none
+        Does: writes the DataFrame to a temporary file next to the Parquet cache and then
+              moves it onto the cache file path, so that a partially written cache is never
+              read as the cache
+        """
+        temp_filename = cache_filename.with_name(f"{cache_filename.name}.{os.getpid()}.tmp")
+        try:
+            df.to_parquet(temp_filename, engine = "pyarrow", index = False)
+            os.replace(temp_filename, cache_filename)
+        finally:
+            temp_filename.unlink(missing_ok = True)
+
+
+    @staticmethod
+    def is_cache_current(csv_filename, cache_filename):
+        """
+        Parameters: csv_filename (str) - the file path to a dataset in CSV format
+                    cache_filename (Path) - the file path to the dataset's Parquet cache
+        Returns: a boolean
+        Does: checks whether the Parquet cache exists and is at least as recent as the CSV file
+        """
+        return (cache_filename.exists() and
+                cache_filename.stat().st_mtime >= Path(csv_filename).stat().st_mtime)
+
+
+    @staticmethod
+    def is_sorted_by_company_and_date(stocks_df):
+        """
+        Parameters: stocks_df (pd.DataFrame) - a long-form stock DataFrame
+        Returns: a boolean
+        Does: checks whether the stock DataFrame has a categorical "Full Name" column with
+              each company's rows in one contiguous block sorted by date, in category order
+        """
+        if not isinstance(stocks_df["Full Name"].dtype, pd.CategoricalDtype):
+            return False
+
+        codes = stocks_df["Full Name"].cat.codes.to_numpy()
+        dates = stocks_df["Date"].to_numpy()
+        code_steps = np.diff(codes)
+        date_steps = np.diff(dates)
+
+        return bool((codes >= 0).all() and (code_steps >= 0).all() and
+                    (date_steps[code_steps == 0] >= np.timedelta64(0)).all())
+
+
     def get_company_names(self):
         """
         Parameters: none
         Returns: a list
-        Does: extracts a sorted list of company names from the ESG DataFrame
+        Does: returns the sorted list of company names from the ESG DataFrame,
+              computed once when the data is read
         """
-        return sorted(self.esg["Full Name"].tolist())
+        return self.company_names
 
 
     @staticmethod
@@ -70,13 +213,28 @@ class ESGStockAPI:
         Does: classifies the company's overall ESG score into high, medium, or low levels
               based on its percentile
         """
-        if percentile >= 66:
+        if percentile >= HIGH_ESG_PERCENTILE:
             return "High ESG"
-        elif percentile >= 33:
+        elif percentile >= MEDIUM_ESG_PERCENTILE:
             return "Medium ESG"
         return "Low ESG"
 
 
+    @staticmethod
+    def classify_esg_levels(percentiles):
+        """
+        Parameters: percentiles (pd.Series) - the values representing each company’s ESG performance
+                                              relative to other companies
+        Returns: a categorical Series
+        Does: classifies each company's overall ESG score into high, medium, or low levels
+              based on its percentile, using the same cutoffs as classify_esg
+        """
+        levels = np.select([percentiles >= HIGH_ESG_PERCENTILE, percentiles >= MEDIUM_ESG_PERCENTILE],
+                           ["High ESG", "Medium ESG"], default = "Low ESG")
+
+        return pd.Series(pd.Categorical(levels, categories = ESG_LEVELS), index = percentiles.index)
+
+
     @staticmethod
     def classify_beta(beta):
         """
@@ -84,13 +242,27 @@ class ESGStockAPI:
         Returns: a string
         Does: classifies beta into low, medium, or high market risk levels
         """
-        if beta < 0.8:
+        if beta < LOW_BETA_CUTOFF:
             return "Low Beta"
-        elif beta <= 1.2:
+        elif beta <= MEDIUM_BETA_CUTOFF:
             return "Medium Beta"
         return "High Beta"
 
 
+    @staticmethod
+    def classify_beta_levels(betas):
+        """
+        Parameters: betas (pd.Series) - stock betas (market risk sensitivity)
+        Returns: a categorical Series
+        Does: classifies each beta into low, medium, or high market risk levels,
+              using the same cutoffs as classify_beta
+        """
+        levels = np.select([betas < LOW_BETA_CUTOFF, betas <= MEDIUM_BETA_CUTOFF],
+                           ["Low Beta", "Medium Beta"], default = "High Beta")
+
+        return pd.Series(pd.Categorical(levels, categories = BETA_LEVELS), index = betas.index)
+
+
     def build_esg_risk_hierarchy(self, company_names, esg_levels = None, beta_levels = None):
         """
         Parameters: company_names (list) - a list of company names to include
@@ -100,32 +272,58 @@ class ESGStockAPI:
         Does: generates a DataFrame with each selected company's individual ESG dimension scores,
               ESG level, and beta levels
         """
-        # Filter the ESG DataFrame to include only the selected companies
-        fltr_esg_df = self.esg[self.esg["Full Name"].isin(company_names)].copy()
-
-        # Classify the ESG and beta levels and filter the DataFrame
-        # based on the selected levels if specified
-        fltr_esg_df["ESG Level"] = fltr_esg_df["percentile"].apply(self.classify_esg)
+        # Filter the ESG DataFrame to include only the selected companies, with the selected
+        # ESG and beta levels if specified, and the columns needed for the breakdown
+        mask = self.esg["Full Name"].isin(company_names)
         if esg_levels:
-            fltr_esg_df = fltr_esg_df[fltr_esg_df["ESG Level"].isin(esg_levels)]
-
-        fltr_esg_df["Beta Level"] = fltr_esg_df["beta"].apply(self.classify_beta)
+            mask &= self.esg["ESG Level"].isin(esg_levels)
         if beta_levels:
-            fltr_esg_df = fltr_esg_df[fltr_esg_df["Beta Level"].isin(beta_levels)]
+            mask &= self.esg["Beta Level"].isin(beta_levels)
+        fltr_esg_df = self.esg.loc[mask, ["Full Name", "ESG Level", "Beta Level", *ESG_DIMENSIONS]]
 
-        # Iterate over the DataFrame and for each company, append the individual score
-        # of each ESG dimension, along with its corresponding ESG and beta levels,
-        # to the designated list
-        esg_risk_breakdown = []
-        for _, row in fltr_esg_df.iterrows():
-            for dim, col in zip(["Environmental", "Social", "Governance"],
-                                ["environmentScore", "socialScore", "governanceScore"]):
-                esg_risk_breakdown.append({"Company": row["Full Name"],
-                                           "ESG Dimension": dim, "ESG Level": row["ESG Level"],
-                                           "Beta Level": row["Beta Level"],
-                                           "Score": row[col]})
+        # Reshape the DataFrame so that each company has one row per ESG dimension score,
+        # along with its corresponding ESG and beta levels
+        esg_risk_df = fltr_esg_df.melt(id_vars = ["Full Name", "ESG Level", "Beta Level"],
+                                       value_vars = list(ESG_DIMENSIONS),
+                                       var_name = "ESG Dimension", value_name = "Score")
+        esg_risk_df["ESG Dimension"] = esg_risk_df["ESG Dimension"].map(ESG_DIMENSIONS)
+        esg_risk_df = esg_risk_df.rename(columns = {"Full Name": "Company"})
 
-        return pd.DataFrame(esg_risk_breakdown)
+        return esg_risk_df[["Company", "ESG Dimension", "ESG Level", "Beta Level", "Score"]]
+
+
+    def locate_stock_prices(self, company_names, start_date = None, end_date = None):
+        """
+        Parameters: company_names (list) - a list of company names to include
+                    start_date (datetime.date, optional) - the earliest date to filter
+                                                           the stock prices by
+                    end_date (datetime.date, optional) - the latest date to filter
+                                                         the stock prices by
+        Returns: a tuple
+        Does: finds the selected companies that have stock prices, in sorted order, along with
+              arrays of the start and end (exclusive) positions of their rows in the stock
+              DataFrame within the date range
+        """
+        names = sorted(name for name in set(company_names) if name in self.stock_slices)
+        dates = self.stocks["Date"].to_numpy()
+        starts = np.empty(len(names), dtype = np.intp)
+        ends = np.empty(len(names), dtype = np.intp)
+
+        # Binary search the sorted dates of each company for the optional start and end dates
+        if start_date:
+            start_dt = pd.to_datetime(start_date).to_datetime64().astype(dates.dtype)
+        if end_date:
+            end_dt = pd.to_datetime(end_date).to_datetime64().astype(dates.dtype)
+
+        for i, name in enumerate(names):
+            start, end = self.stock_slices[name]
+            starts[i], ends[i] = start, end
+            if start_date:
+                starts[i] = start + np.searchsorted(dates[start:end], start_dt, side = "left")
+            if end_date:
+                ends[i] = start + np.searchsorted(dates[start:end], end_dt, side = "right")
+
+        return names, starts, ends
 
 
     def extract_stock_price_trends(self, company_names, start_date = None, end_date = None):
@@ -139,16 +337,19 @@ class ESGStockAPI:
         Does: generates a DataFrame with the date, company name, and stock price for each record,
               filtered by the selected companies and date range
         """
-        # Filter the stock DataFrame to include only the selected companies
-        fltr_stocks_df = self.stocks[self.stocks["Full Name"].isin(company_names)].copy()
+        # Find the rows of the selected companies within the date range and collect
+        # their positions
+        _, starts, ends = self.locate_stock_prices(company_names, start_date, end_date)
+        rows = [np.arange(start, end) for start, end in zip(starts, ends)]
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype = np.intp)
 
-        # Apply optional start and end date filters to the stock prices
-        if start_date:
-            fltr_stocks_df = fltr_stocks_df[fltr_stocks_df["Date"] >= pd.to_datetime(start_date)]
-        if end_date:
-            fltr_stocks_df = fltr_stocks_df[fltr_stocks_df["Date"] <= pd.to_datetime(end_date)]
+        # Filter the stock DataFrame to include only the matching rows and the date,
+        # company name, and price columns
+        fltr_stocks_df = self.stocks[["Date", "Full Name", "Price"]].take(rows)
 
-        return fltr_stocks_df[["Date", "Full Name", "Price"]].sort_values(["Full Name", "Date"])
+        # The stock DataFrame is sorted by company and date at ingest time and the companies
+        # are taken in sorted order, so the filtered DataFrame is already sorted
+        return fltr_stocks_df
 
 
     def compute_rolling_returns(self, company_names, end_date, months = 6):
@@ -163,18 +364,27 @@ class ESGStockAPI:
         end_dt = pd.to_datetime(end_date)
         start_dt = end_dt - pd.DateOffset(months = months)
 
-        # Compute the stock returns in percentage over the selected lookback window
-        prices_df = self.extract_stock_price_trends(company_names, start_date = start_dt,
-                                                    end_date = end_dt)
-        if prices_df.empty:
+        # Find the rows of the selected companies within the selected lookback window,
+        # keeping only the companies that have stock prices in the window
+        names, starts, ends = self.locate_stock_prices(company_names, start_date = start_dt,
+                                                       end_date = end_dt)
+        has_prices = ends > starts
+        if not has_prices.any():
             return pd.DataFrame(columns = ["Full Name", "start_price", "end_price", "Stock Return"])
+        names = np.asarray(names, dtype = object)[has_prices]
+        starts, ends = starts[has_prices], ends[has_prices]
 
-        grouped = prices_df.sort_values(["Full Name", "Date"]).groupby("Full Name", as_index = False)
-        start_end = grouped.agg(start_price = ("Price", "first"), end_price = ("Price", "last"))
-        start_end["Stock Return"] = ((start_end["end_price"] - start_end["start_price"]) /
-                                     start_end["start_price"] * 100)
+        # Compute the stock returns in percentage over the selected lookback window
+        # from the first and last prices of each company's rows, which are sorted by date
+        from src.returns import compute_returns
+        start_prices = np.empty(len(names))
+        end_prices = np.empty(len(names))
+        stock_returns = np.empty(len(names))
+        compute_returns(self.stocks["Price"].to_numpy(), starts, ends,
+                        start_prices, end_prices, stock_returns)
 
-        return start_end
+        return pd.DataFrame({"Full Name": names, "start_price": start_prices,
+                             "end_price": end_prices, "Stock Return": stock_returns})
 
 
     def analyze_esg_vs_stock_returns(self, company_names, end_date, beta_levels = None, months = 6):
@@ -188,14 +398,12 @@ class ESGStockAPI:
               generates a DataFrame with each selected company's overall ESG score,
               rolling stock return, and beta level
         """
-        # Filter the ESG DataFrame to include only the selected companies
-        fltr_esg_df = self.esg[self.esg["Full Name"].isin(company_names)].copy()
-
-        # Classify the beta levels and filter the DataFrame
-        # based on the selected levels if specified
-        fltr_esg_df["Beta Level"] = fltr_esg_df["beta"].apply(self.classify_beta)
+        # Filter the ESG DataFrame to include only the selected companies, with the selected
+        # beta levels if specified, and the columns needed for the analysis
+        mask = self.esg["Full Name"].isin(company_names)
         if beta_levels:
-            fltr_esg_df = fltr_esg_df[fltr_esg_df["Beta Level"].isin(beta_levels)]
+            mask &= self.esg["Beta Level"].isin(beta_levels)
+        fltr_esg_df = self.esg.loc[mask, ["Full Name", "totalEsg", "Beta Level"]]
 
         # Compute the rolling stock returns in percentage ending on the specified date
         stock_returns_df = self.compute_rolling_returns(fltr_esg_df["Full Name"].tolist(),
@@ -13,6 +13,7 @@ import panel as pn
 from src import sankey as sk
 from src import plot as pt
 from src.esgstocks_api import ESGStockAPI
+from functools import lru_cache
 from pathlib import Path
 
 # Loads javascript dependencies and configures Panel (required)
@@ -26,11 +27,15 @@ DATA_DIR = PROJECT_ROOT / "data"
 api = ESGStockAPI()
 api.read_data(DATA_DIR / "sp500_esg_data.csv", DATA_DIR / "sp500_price_data.csv")
 
+# Get the company names and the date range of the stock prices once for the widgets
+all_company_names = api.get_company_names()
+min_date, max_date = api.stocks["Date"].min(), api.stocks["Date"].max()
+
 
 # SEARCH WIDGET DECLARATIONS (FOR FILTERING DATA)
 company_selector = pn.widgets.MultiChoice(name = "Select Companies",
-                                          options = api.get_company_names(),
-                                          value = [api.get_company_names()[1]],
+                                          options = all_company_names,
+                                          value = [all_company_names[1]],
                                           solid = False, sizing_mode = "stretch_width")
 beta_filter = pn.widgets.CheckButtonGroup(name = "Beta Level", options = ["Low Beta", "Medium Beta", "High Beta"],
                                           button_type = "danger", value = [])
@@ -41,10 +46,8 @@ esg_filter = pn.widgets.CheckButtonGroup(name = "ESG Level",
 
 # PLOTTING WIDGET DECLARATIONS
 date_range_slider = pn.widgets.DateRangeSlider(name = "Date Range",
-                                               start = api.stocks["Date"].min(),
-                                               end = api.stocks["Date"].max(),
-                                               value = (api.stocks["Date"].min(),
-                                                        api.stocks["Date"].max()),
+                                               start = min_date, end = max_date,
+                                               value = (min_date, max_date),
                                                sizing_mode = "stretch_width")
 width_slider = pn.widgets.IntSlider(name = "Width", start = 200, end = 2000, step = 100,
                                     value = 1000)
@@ -52,24 +55,105 @@ height_slider = pn.widgets.IntSlider(name = "Height", start = 200, end = 2500, s
                                      value = 700)
 
 
-# CALLBACK FUNCTIONS
-def get_sankey_diagram(company_names, esg_levels, beta_levels, width, height):
+# CACHED DATA FUNCTIONS (SO THAT REPEATED FILTER SELECTIONS DO NOT REPEAT THE DATA PROCESSING)
+@lru_cache(maxsize = 64)
+def get_esg_risk_hierarchy(company_names, esg_levels, beta_levels):
+    """
+    Parameters: company_names (tuple) - a sorted tuple of company names to include
+                esg_levels (tuple) – a sorted tuple of the esg levels to filter by
+                beta_levels (tuple) – a sorted tuple of the beta levels to filter by
+    Returns: a DataFrame
+    Does: generates the ESG risk hierarchy DataFrame for the given filters, reusing the result
+          of earlier calls with the same filters
+    """
+    return api.build_esg_risk_hierarchy(list(company_names), esg_levels = list(esg_levels),
+                                        beta_levels = list(beta_levels))
+
+
+@lru_cache(maxsize = 64)
+def get_stock_price_trends(company_names, start_date, end_date):
+    """
+    Parameters: company_names (tuple) - a sorted tuple of company names to include
+                start_date (datetime.date) - the earliest date to filter the stock prices by
+                end_date (datetime.date) - the latest date to filter the stock prices by
+    Returns: a DataFrame
+    Does: generates the stock price trends DataFrame for the given filters, reusing the result
+          of earlier calls with the same filters
+    """
+    return api.extract_stock_price_trends(list(company_names), start_date = start_date,
+                                          end_date = end_date)
+
+
+@lru_cache(maxsize = 64)
+def get_esg_vs_stock_returns(company_names, end_date, beta_levels):
+    """
+    Parameters: company_names (tuple) - a sorted tuple of company names to include
+                end_date (datetime.date) - the end date for computing rolling stock returns
+                beta_levels (tuple) – a sorted tuple of the beta levels to filter by
+    Returns: a DataFrame
+    Does: generates the ESG score vs. rolling stock return DataFrame for the given filters,
+          reusing the result of earlier calls with the same filters
+    """
+    return api.analyze_esg_vs_stock_returns(list(company_names), end_date = end_date,
+                                            beta_levels = list(beta_levels), months = 6)
+
+
+# DATA CALLBACK FUNCTIONS
+def get_sankey_data(company_names, esg_levels, beta_levels):
     """
     Parameters: company_names (list) - a list of company names to include
                 esg_levels (list) – the esg levels to filter by
                 beta_levels (list) – the beta levels to filter by
+    Returns: a DataFrame
+    Does: filters the ESG DataFrame by selected companies, ESG levels, and beta levels, and
+          generates the breakdown of each company's ESG dimension scores for the Sankey diagram
+    """
+    return get_esg_risk_hierarchy(tuple(sorted(company_names)), tuple(sorted(esg_levels)),
+                                  tuple(sorted(beta_levels)))
+
+
+def get_line_data(company_names, date_range):
+    """
+    Parameters: company_names (list) - a list of company names to include
+                date_range (tuple) - the start date and end date to filter by
+    Returns: a DataFrame
+    Does: filters the stock DataFrame for the selected companies and date range
+    """
+    start_date, end_date = date_range
+
+    return get_stock_price_trends(tuple(sorted(company_names)), start_date, end_date)
+
+
+def get_scatter_data(company_names, date_range, beta_levels):
+    """
+    Parameters: company_names (list) - a list of company names to include
+                date_range (tuple) - the start date and end date to filter by
+                beta_levels (list) – the beta levels to filter by
+    Returns: a DataFrame
+    Does: computes rolling stock returns for the selected companies ending on the specified date
+          and generates a DataFrame comparing them with the companies' ESG scores
+    """
+    _, end_date = date_range
+
+    return get_esg_vs_stock_returns(tuple(sorted(company_names)), end_date,
+                                    tuple(sorted(beta_levels)))
+
+
+# PLOT CALLBACK FUNCTIONS
+def get_sankey_diagram(df, width, height):
+    """
+    Parameters: df (pd.DataFrame) - the breakdown of the selected companies' ESG dimension scores
                 width (int) – the width of the Sankey diagram
                 height (int) – the height of the Sankey diagram
     Returns: a Plotly Sankey diagram
-    Does: filters the ESG DataFrame by selected companies, ESG levels, and beta levels,
-          and creates a Sankey diagram visualizing the flow from ESG dimensions to beta levels,
+    Does: creates a Sankey diagram visualizing the flow from ESG dimensions to beta levels,
           sized based on the given width and height
     """
-    df = api.build_esg_risk_hierarchy(company_names, esg_levels = esg_levels, beta_levels = beta_levels)
     if df.empty:
         return pn.pane.Markdown("### No visualization is available for the selected filters.")
 
-    fig = sk.make_sankey(df, "Company", "ESG Dimension", "ESG Level", "Beta Level",
+    # Pass a copy since make_sankey adds a value column to the cached DataFrame
+    fig = sk.make_sankey(df.copy(), "Company", "ESG Dimension", "ESG Level", "Beta Level",
                          vals = "Score", title = "ESG Dimension to Beta Level Flow for "
                                                  "Selected S&P 500 Companies (2023)",
                          width = width, height = height)
@@ -77,20 +161,15 @@ def get_sankey_diagram(company_names, esg_levels, beta_levels, width, height):
     return fig
 
 
-def get_line_plot(company_names, date_range, width, height):
+def get_line_plot(df, width, height):
     """
-    Parameters: company_names (list) - a list of company names to include
-                date_range (tuple) - the start date and end date to filter by
+    Parameters: df (pd.DataFrame) - the stock prices of the selected companies and date range
                 width (int) – the width of the line plot
                 height (int) – the height of the line plot
     Returns: a Plotly line plot
-    Does: filters the stock Dataframe for the selected companies and date range, and
-          creates a line plot visualizing stock price trends over time, sized based on
+    Does: creates a line plot visualizing stock price trends over time, sized based on
           the given width and height
     """
-    start_date, end_date = date_range
-
-    df = api.extract_stock_price_trends(company_names, start_date = start_date, end_date = end_date)
     if df.empty:
         return pn.pane.Markdown("### No visualization is available for the selected filters.")
 
@@ -102,22 +181,16 @@ def get_line_plot(company_names, date_range, width, height):
     return fig
 
 
-def get_scatter_plot(company_names, date_range, beta_levels, width, height):
+def get_scatter_plot(df, width, height):
     """
-    Parameters: company_names (list) - a list of company names to include
-                date_range (tuple) - the start date and end date to filter by
-                beta_levels (list) – the beta levels to filter by
+    Parameters: df (pd.DataFrame) - the ESG scores, rolling stock returns, and beta levels
+                                    of the selected companies
                 width (int) – the width of the scatter plot
                 height (int) – the height of the scatter plot
     Returns: a Plotly scatter plot
-    Does: computes rolling stock returns for the selected companies ending on the specified date,
-          and creates a scatter plot comparing ESG scores with rolling stock returns, colored by
+    Does: creates a scatter plot comparing ESG scores with rolling stock returns, colored by
           beta levels and sized based on the given width and height
     """
-    _, end_date = date_range
-
-    df = api.analyze_esg_vs_stock_returns(company_names, end_date = end_date,
-                                          beta_levels = beta_levels, months = 6)
     if df.empty:
         return pn.pane.Markdown("### No visualization is available for the selected filters.")
 
@@ -130,12 +203,15 @@ def get_scatter_plot(company_names, date_range, beta_levels, width, height):
 
 
 # CALLBACK BINDINGS
-sankey_diagram = pn.bind(get_sankey_diagram, company_selector, esg_filter, beta_filter,
-                         width_slider, height_slider)
-line_plot = pn.bind(get_line_plot, company_selector, date_range_slider,
-                    width_slider, height_slider)
-scatter_plot = pn.bind(get_scatter_plot, company_selector, date_range_slider, beta_filter,
-                       width_slider, height_slider)
+# Bind the data callbacks to the search widgets only, as reactive expressions that hold their
+# latest DataFrame, so that changing the width or height only redraws the plots
+sankey_data = pn.bind(get_sankey_data, company_selector, esg_filter, beta_filter).rx()
+line_data = pn.bind(get_line_data, company_selector, date_range_slider).rx()
+scatter_data = pn.bind(get_scatter_data, company_selector, date_range_slider, beta_filter).rx()
+
+sankey_diagram = pn.bind(get_sankey_diagram, sankey_data, width_slider, height_slider)
+line_plot = pn.bind(get_line_plot, line_data, width_slider, height_slider)
+scatter_plot = pn.bind(get_scatter_plot, scatter_data, width_slider, height_slider)
 
 
 # DASHBOARD WIDGET CONTAINERS
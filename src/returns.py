@@ -0,0 +1,41 @@
+"""
+Filename: returns.py
+Author: Dang Nguyen
+Description: A module for computing stock returns with a Numba-compiled kernel over the stock
+             prices of the ESGStockAPI, which are sorted by company and date. It is imported
+             only when stock returns are computed, so the kernel is compiled only when needed.
+"""
+
+import numpy as np
+from numba import njit
+
+@njit(cache = True)
+def compute_returns(prices, starts, ends, start_prices, end_prices, stock_returns):
+    """
+    Parameters: prices (np.ndarray) - the stock prices sorted by company and date
+                starts (np.ndarray) - the start positions of each company's prices
+                ends (np.ndarray) - the end (exclusive) positions of each company's prices
+                start_prices (np.ndarray) - the array to fill with each company's start price
+                end_prices (np.ndarray) - the array to fill with each company's end price
+                stock_returns (np.ndarray) - the array to fill with each company's stock return
+    Returns: none
+    Does: finds the first and last non-missing prices of each company between its start and end
+          positions and computes the stock return between them in percentage
+    """
+    for i in range(starts.size):
+        # Skip missing prices at either end of the company's prices
+        first = starts[i]
+        while first < ends[i] and np.isnan(prices[first]):
+            first += 1
+        last = ends[i] - 1
+        while last > first and np.isnan(prices[last]):
+            last -= 1
+
+        if first == ends[i]:
+            start_prices[i] = np.nan
+            end_prices[i] = np.nan
+            stock_returns[i] = np.nan
+        else:
+            start_prices[i] = prices[first]
+            end_prices[i] = prices[last]
+            stock_returns[i] = (prices[last] - prices[first]) / prices[first] * 100
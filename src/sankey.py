@@ -8,9 +8,10 @@ Description: A library for generating customizable multi-level Sankey diagrams u
 """
 
 import plotly.graph_objects as go
+from functools import lru_cache
+import numpy as np
 import pandas as pd
-import matplotlib.cm as cm
-import matplotlib.colors as mcolors
+import matplotlib as mpl
 
 def stack_columns(df, cols):
     """
@@ -21,18 +22,15 @@ def stack_columns(df, cols):
     Does: pairs adjacent columns of the given DataFrame to form source-target relationships and
           stacks them vertically to create a new DataFrame with source, target, and value columns
     """
-    # Create an empty list to store DataFrames for each column pair
-    stacked_dfs = []
+    # Pair each column with the next one to form the source-target relationships
+    pairs = list(zip(cols, cols[1:]))
 
-    # Iterate and create a DataFrame for each adjacent column pair with source, target, and
-    # value columns, then add it to the list
-    for col1, col2 in zip(cols, cols[1:]):
-        pair_df = df[[col1, col2, "value"]]
-        pair_df.columns = ["src", "targ", "value"]
-        stacked_dfs.append(pair_df)
-
-    # Concatenate all DataFrames in the list into a single DataFrame
-    stacked_df = pd.concat(stacked_dfs, ignore_index = True)
+    # Concatenate the source columns, the target columns, and the repeated value column
+    # of all pairs into single arrays and create a DataFrame from them
+    srcs = np.concatenate([df[col1].to_numpy() for col1, _ in pairs])
+    targs = np.concatenate([df[col2].to_numpy() for _, col2 in pairs])
+    vals = np.tile(df["value"].to_numpy(), len(pairs))
+    stacked_df = pd.DataFrame({"src": srcs, "targ": targs, "value": vals})
 
     return stacked_df
 
@@ -46,21 +44,39 @@ def code_mapping(df, src, targ):
     Does: maps and replaces labels in the source and target columns of the DataFrame
           with integer codes
     """
-    # Create a list of unique labels from both the source and target columns and
-    # a list of integer codes for each label
-    labels = list(set(df[src]).union(set(df[targ])))
-    codes = list(range(len(labels)))
-
-    # Create a mapping from the labels to the integer codes
-    lc_map = dict(zip(labels, codes))
+    # Encode the labels from both the source and target columns together as integer codes,
+    # numbered in order of first appearance
+    combined = pd.concat([df[src], df[targ]], ignore_index = True)
+    codes, labels = pd.factorize(combined, sort = False)
 
     # Replace the values in the source and target columns in the DataFrame with the integer codes
-    df[src] = df[src].map(lc_map)
-    df[targ] = df[targ].map(lc_map)
+    n = len(df)
+    df[src] = codes[:n]
+    df[targ] = codes[n:]
+    labels = list(labels)
 
     return df, labels
 
 
+@lru_cache(maxsize = 8)
+def get_node_colors(n):
+    """
+    Parameters: n (int) - the number of nodes in the Sankey diagram
+    Returns: a tuple
+    Does: generates a tuple of hex colors for the nodes from the tab20 colormap and a tuple of
+          matching rgba colors with lower opacity for the links, reusing the colors computed
+          for earlier diagrams with the same number of nodes
+    """
+    # Sample n colors from the tab20 colormap and convert them to 8-bit RGB values at once
+    cmap = mpl.colormaps["tab20"].resampled(n)
+    rgb = np.round(cmap(np.arange(n))[:, :3] * 255).astype(np.uint8)
+
+    node_colors = tuple("#%02x%02x%02x" % tuple(row) for row in rgb)
+    node_rgba = tuple("rgba(%d, %d, %d, 0.3)" % tuple(row) for row in rgb)
+
+    return node_colors, node_rgba
+
+
 def make_sankey(df, *cols, vals = None, title = None, **kwargs):
     """
     Parameters: df (pd.DataFrame) - a DataFrame with columns to be visualized as levels
@@ -89,20 +105,10 @@ def make_sankey(df, *cols, vals = None, title = None, **kwargs):
     # Map and replace labels in the source and target columns of the DataFrame with integer codes
     df, labels = code_mapping(df, "src", "targ")
 
-    # Assign a color to each node
-    cmap = cm.get_cmap("tab20", len(labels))
-    node_colors = []
-    for i in range(len(labels)):
-        rgba = cmap(i)
-        hex_color = mcolors.to_hex(rgba)
-        node_colors.append(hex_color)
-
-    # Assign a matching color to each link based on its source node with lower opacity
-    link_colors = []
-    for src in df["src"]:
-        r, g, b = mcolors.to_rgb(node_colors[src])
-        rgba_str = f"rgba({int(r * 255)}, {int(g * 255)}, {int(b * 255)}, 0.3)"
-        link_colors.append(rgba_str)
+    # Assign a color to each node and a matching color to each link based on its source node
+    # with lower opacity, looking up the colors of all links by source code
+    node_colors, node_rgba = get_node_colors(len(labels))
+    link_colors = np.asarray(node_rgba, dtype = object)[df["src"].to_numpy()]
 
     # Customize layout, sizing, and fonts of the Sankey diagram
     padding = kwargs.get("padding", 50)